@@ -37,22 +37,68 @@ def load_dna_sequence(path):
     return sequence
 
 
+def load_fasta_records(path):
+    """Return a list of (record_id, sequence) pairs from a FASTA file.
+
+    The record id is the first word of the header line. Sequence lines
+    before any header belong to a record named after the file stem.
+    Blank lines are ignored and records with no sequence are dropped.
+    """
+    records = []
+    name, parts = Path(path).stem, []
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                if parts:
+                    records.append((name, ''.join(parts).upper()))
+                fields = line[1:].split()
+                if not fields:
+                    sys.exit(f"Error: Empty FASTA header on line {line_num} of {path}")
+                name, parts = fields[0], []
+            else:
+                parts.append(line)
+    if parts:
+        records.append((name, ''.join(parts).upper()))
+    if not records:
+        sys.exit(f"Error: No sequence data found in {path}")
+    return records
+
+
 def reverse_complement(seq):
     comp = str.maketrans('ACGTacgt', 'TGCAtgca')
     return seq.translate(comp)[::-1]
 
 
+BASE2IDX = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+
+
 def score_window(window, profile):
-    base2idx = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
     score = 0.0
     for i, base in enumerate(window):
-        idx = base2idx.get(base)
+        idx = BASE2IDX.get(base)
         if idx is None:
             continue
         score += profile[idx][i]
     return score
 
 
+def scan_sequence(sequence, profile, start=0, end=None):
+    """Yield (position, score_forward, score_reverse, score_best) for every
+    window that starts in [start, end). Positions are 0-based in sequence."""
+    motif_len = len(profile[0])
+    last = len(sequence) - motif_len + 1
+    if end is None or end > last:
+        end = last
+    for pos in range(max(start, 0), end):
+        window = sequence[pos:pos + motif_len]
+        sf = score_window(window, profile)
+        sr = score_window(reverse_complement(window), profile)
+        yield pos, sf, sr, max(sf, sr)
+
+
 def main():
     # Accept 2 or 3 positional arguments (motif, sequence, optional output)
     if len(sys.argv) not in (3, 4):
@@ -78,12 +124,7 @@ def main():
             writer.writerow(["position", "score_forward", "score_reverse", "score_best"])
 
             # Scan windows
-            for pos in range(seq_len - motif_len + 1):
-                window = sequence[pos:pos + motif_len]
-                sf = score_window(window, profile)
-                rcw = reverse_complement(window)
-                sr = score_window(rcw, profile)
-                sb = max(sf, sr)
+            for pos, sf, sr, sb in scan_sequence(sequence, profile):
                 writer.writerow([pos, f"{sf:.4f}", f"{sr:.4f}", f"{sb:.4f}"])
 
         print(f"Results written to {out_path}")
@@ -92,12 +133,7 @@ def main():
         writer.writerow(["position", "score_forward", "score_reverse", "score_best"])
 
         # Scan windows
-        for pos in range(seq_len - motif_len + 1):
-            window = sequence[pos:pos + motif_len]
-            sf = score_window(window, profile)
-            rcw = reverse_complement(window)
-            sr = score_window(rcw, profile)
-            sb = max(sf, sr)
+        for pos, sf, sr, sb in scan_sequence(sequence, profile):
             writer.writerow([pos, f"{sf:.4f}", f"{sr:.4f}", f"{sb:.4f}"])
 
 if __name__ == '__main__':
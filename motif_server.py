@@ -0,0 +1,527 @@
+"""Long-running local scoring server for motif scans, translation and ORFs.
+
+Running ``motif_scoring.py`` for every small query re-reads the motif profile
+and the reference each time. This server keeps parsed profiles and loaded
+references in memory (reloaded only when the file changes on disk) and
+answers requests over a Unix socket or a localhost TCP port.
+
+Protocol: one JSON object per line in, one JSON object per line out.
+
+    {"id": 1, "op": "scan", "motif": "motif.txt", "reference": "seq.fa",
+     "start": 1000, "end": 1100}
+    {"id": 2, "op": "translate", "sequence": "ATGCAACAG"}
+    {"id": 3, "op": "orf", "reference": "asm.fa", "record": "contig7",
+     "start": 0, "end": 5000}
+    {"id": 4, "op": "stats"}
+
+Replies look like ``{"id": 1, "ok": true, "result": ...}`` or
+``{"id": 1, "ok": false, "error": "..."}``.
+
+References are indexed by record id (the first word of each FASTA header).
+A request on a multi-record reference must name its ``record``; positions
+are relative to that record and scans never cross record boundaries. A
+request line may be at most MAX_REQUEST_BYTES (64 MiB); longer lines are
+discarded and get an error reply. Use ``reference`` for anything bigger.
+
+Requests arriving within a few milliseconds of each other are collected into
+one batch. Each distinct motif and reference path in a batch is resolved
+against the cache once, then every request runs as its own job on a thread
+pool, and replies are encoded there, so the event loop never blocks on file
+I/O or scoring.
+
+Scoring is pure Python and holds the GIL, so worker threads don't score in
+parallel. Regions longer than OFFLOAD_BASES are therefore sent, with their
+reply encoding, to a pool of worker processes (``--processes``), which keeps
+long scans from slowing down small queries. Small queries still share the
+GIL with each other, so latency rises when many of them run at once.
+
+Usage:
+    python motif_server.py --socket /tmp/motif.sock
+    python motif_server.py --port 8765 --workers 4 --processes 2
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import stat
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from dna import codingStrandToAA
+from motif_scoring import load_fasta_records, load_motif_profile, scan_sequence
+from orf import longestORF
+
+# Constants
+BATCH_WINDOW = 0.002  # Seconds to wait for more requests before dispatching
+MAX_BATCH = 64
+DEFAULT_WORKERS = 4
+DEFAULT_PROCESSES = 2
+OFFLOAD_BASES = 20_000  # Longer regions are handled in a worker process
+MAX_REQUEST_BYTES = 64 * 1024 * 1024  # Longest accepted request line
+
+# Per-batch lookups: (kind, path) -> loaded value, or the error loading it
+Resolved = Dict[Tuple[str, str], Any]
+
+
+def load_reference_index(path: Path) -> Dict[str, str]:
+    """Load a FASTA reference as a {record_id: sequence} map."""
+    index: Dict[str, str] = {}
+    for record_id, seq in load_fasta_records(path):
+        if record_id in index:
+            raise ValueError(f"duplicate record id {record_id!r} in {path}")
+        index[record_id] = seq
+    return index
+
+
+class _RawJSON(str):
+    """A result that is already JSON text and is embedded in the reply as is."""
+
+
+def _encode(reply: Dict[str, Any]) -> bytes:
+    """Encode a reply as one JSON line."""
+    result = reply.get("result")
+    if isinstance(result, _RawJSON):
+        head = json.dumps({k: v for k, v in reply.items() if k != "result"})
+        return f'{head[:-1]}, "result": {result}}}\n'.encode()
+    return json.dumps(reply).encode() + b"\n"
+
+
+def _scan_rows(sequence: str, profile: List[List[float]], start: int = 0,
+               end: Optional[int] = None, offset: int = 0) -> List[List[float]]:
+    return [[pos + offset, round(sf, 4), round(sr, 4), round(sb, 4)]
+            for pos, sf, sr, sb in scan_sequence(sequence, profile, start, end)]
+
+
+def _scan_json(sequence: str, profile: List[List[float]], offset: int) -> str:
+    """Score every window of sequence and return the rows as JSON text.
+    Runs in a worker process; positions are shifted by offset."""
+    return json.dumps(_scan_rows(sequence, profile, offset=offset))
+
+
+def _translate_json(sequence: str) -> str:
+    return json.dumps(codingStrandToAA(sequence))
+
+
+def _orf_json(sequence: str) -> str:
+    return json.dumps(longestORF(sequence.upper()))
+
+
+class FileCache:
+    """Thread-safe cache of parsed files, keyed by resolved path.
+
+    An entry is reloaded when the file's modification time or size changes.
+    Loads take a per-path lock, so a slow cold load doesn't block hits on
+    other paths, and concurrent requests for the same path load it once.
+    """
+
+    def __init__(self, loader: Callable[[Path], Any]):
+        self._loader = loader
+        self._entries: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def _lookup(self, key: str, stamp: Tuple[int, int]) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return True, entry[1]
+            return False, None
+
+    def get(self, path: str) -> Any:
+        resolved = Path(path).resolve()
+        st = resolved.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = str(resolved)
+        found, value = self._lookup(key, stamp)
+        if found:
+            return value
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            # Another thread may have loaded it while we waited
+            found, value = self._lookup(key, stamp)
+            if found:
+                return value
+            value = self._loader(resolved)
+            with self._lock:
+                self._entries[key] = (stamp, value)
+                self.loads += 1
+            return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ScoringService:
+    """Executes requests against warm profile and reference caches.
+
+    Request handlers take an optional ``resolved`` mapping of
+    ``(kind, path) -> value`` prepared once per batch by ``resolve``; paths
+    missing from it are looked up in the caches directly.
+    """
+
+    def __init__(self, processes: int = DEFAULT_PROCESSES):
+        self.processes: Optional[ProcessPoolExecutor] = None
+        if processes > 0:
+            # spawn, not fork: the server already runs threads
+            self.processes = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"))
+        self.profiles = FileCache(load_motif_profile)
+        self.references = FileCache(load_reference_index)
+        self.requests = 0  # Updated by the Batcher on the event loop thread
+
+    def resolve(self, kind: str, path: str) -> Any:
+        """Return the cached profile ("motif") or record index ("reference")
+        at path. Errors are returned rather than raised, so one bad path in a
+        batch is reported only to the requests that use it."""
+        cache = self.profiles if kind == "motif" else self.references
+        try:
+            return cache.get(path)
+        except (Exception, SystemExit) as e:
+            return e
+
+    def _file(self, kind: str, req: Dict[str, Any], resolved: Resolved) -> Any:
+        path = req[kind]
+        if isinstance(path, str) and (kind, path) in resolved:
+            value = resolved[(kind, path)]
+        else:
+            value = self.resolve(kind, path)
+        if isinstance(value, BaseException):
+            raise value
+        return value
+
+    def _sequence(self, req: Dict[str, Any], resolved: Resolved) -> str:
+        """Return the whole sequence a request refers to."""
+        if "sequence" in req:
+            return str(req["sequence"]).upper()
+        if "reference" in req:
+            index = self._file("reference", req, resolved)
+            record = req.get("record")
+            if record is None:
+                if len(index) != 1:
+                    raise ValueError(f"reference has {len(index)} records; "
+                                     "request needs 'record'")
+                return next(iter(index.values()))
+            if not isinstance(record, str) or record not in index:
+                raise ValueError(f"unknown record: {record!r}")
+            return index[record]
+        raise ValueError("request needs 'sequence' or 'reference'")
+
+    def _bounds(self, req: Dict[str, Any]) -> Tuple[int, Optional[int]]:
+        """Return (start, end) from a request; end is None for "to the end"."""
+        start = int(req.get("start", 0))
+        end = req.get("end")
+        end = None if end is None else int(end)
+        if start < 0 or (end is not None and end < 0):
+            raise ValueError("start and end must not be negative")
+        return start, end
+
+    def _region(self, req: Dict[str, Any], resolved: Resolved) -> str:
+        """Return the requested sequence sliced to [start, end)."""
+        start, end = self._bounds(req)
+        return self._sequence(req, resolved)[start:end]
+
+    def _offload(self, n_bases: int, func: Callable[..., str], *args) -> Optional[_RawJSON]:
+        """Run func in a worker process if the region is large enough to be
+        worth it; returns None when the caller should compute in-thread."""
+        if self.processes is None or n_bases <= OFFLOAD_BASES:
+            return None
+        return _RawJSON(self.processes.submit(func, *args).result())
+
+    def scan(self, req: Dict[str, Any], resolved: Resolved) -> Any:
+        """Score every window starting in [start, end). Windows near end may
+        extend past it; positions are relative to the record or sequence."""
+        if "motif" not in req:
+            raise ValueError("scan request needs 'motif'")
+        profile = self._file("motif", req, resolved)
+        start, end = self._bounds(req)
+        sequence = self._sequence(req, resolved)
+        motif_len = len(profile[0])
+        last = len(sequence) - motif_len + 1
+        stop = last if end is None else min(end, last)
+        # Ship only the bases the requested windows cover
+        raw = self._offload(stop - start, _scan_json,
+                            sequence[start:stop + motif_len - 1], profile, start)
+        if raw is not None:
+            return raw
+        return _scan_rows(sequence, profile, start, end)
+
+    def translate(self, req: Dict[str, Any], resolved: Resolved) -> Any:
+        region = self._region(req, resolved)
+        raw = self._offload(len(region), _translate_json, region)
+        return codingStrandToAA(region) if raw is None else raw
+
+    def orf(self, req: Dict[str, Any], resolved: Resolved) -> Any:
+        region = self._region(req, resolved)
+        raw = self._offload(len(region), _orf_json, region)
+        return longestORF(region.upper()) if raw is None else raw
+
+    def stats(self, req: Dict[str, Any], resolved: Resolved) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "profiles_cached": len(self.profiles),
+            "references_cached": len(self.references),
+            "cache_hits": self.profiles.hits + self.references.hits,
+            "cache_loads": self.profiles.loads + self.references.loads,
+        }
+
+    def close(self) -> None:
+        if self.processes is not None:
+            self.processes.shutdown(wait=False)
+
+    def handle(self, req: Dict[str, Any],
+               resolved: Optional[Resolved] = None) -> bytes:
+        """Run one request and return its encoded reply line. Never raises.
+
+        Encoding happens here, in the worker, so large replies don't stall
+        the event loop."""
+        reply: Dict[str, Any] = {"id": req.get("id")}
+        try:
+            op = req.get("op")
+            handler = {
+                "scan": self.scan,
+                "translate": self.translate,
+                "orf": self.orf,
+                "stats": self.stats,
+            }.get(op) if isinstance(op, str) else None
+            if handler is None:
+                reply.update(ok=False, error=f"unknown op: {op!r}")
+            else:
+                reply.update(ok=True, result=handler(req, resolved or {}))
+        except SystemExit as e:
+            # Loaders in motif_scoring exit on malformed input
+            reply.update(ok=False, error=str(e.code))
+        except Exception as e:
+            reply.update(ok=False, error=str(e))
+        return _encode(reply)
+
+
+class Batcher:
+    """Collects requests into micro-batches and runs them on a thread pool."""
+
+    def __init__(self, service: ScoringService, workers: int = DEFAULT_WORKERS,
+                 window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.service = service
+        self.window = window
+        self.max_batch = max_batch
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.queue: "asyncio.Queue[Tuple[Dict[str, Any], asyncio.Future]]" = asyncio.Queue()
+        self._in_flight: Set[asyncio.Task] = set()
+
+    async def submit(self, req: Dict[str, Any]) -> bytes:
+        """Queue a request and return its encoded reply line."""
+        # Counted here, on the event loop, rather than in the pool threads
+        self.service.requests += 1
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((req, fut))
+        return await fut
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Don't wait for this batch; the next one can start collecting now
+            task = loop.create_task(self._dispatch(items))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, items) -> None:
+        loop = asyncio.get_running_loop()
+        # Resolve each distinct file once for the whole batch
+        keys = sorted({(kind, req[kind]) for req, _ in items
+                       for kind in ("motif", "reference")
+                       if isinstance(req.get(kind), str)})
+        try:
+            values = await asyncio.gather(*(
+                loop.run_in_executor(self.pool, self.service.resolve, kind, path)
+                for kind, path in keys))
+            resolved: Resolved = dict(zip(keys, values))
+        except Exception:
+            # Fall back to per-request cache lookups
+            resolved = {}
+        # One pool job per request, so short queries don't wait on long scans
+        await asyncio.gather(*(self._run_one(req, fut, resolved)
+                               for req, fut in items))
+
+    async def _run_one(self, req: Dict[str, Any], fut: asyncio.Future,
+                       resolved: Resolved) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            reply = await loop.run_in_executor(
+                self.pool, self.service.handle, req, resolved)
+        except Exception as e:
+            # Never leave a client waiting on a request that failed outright
+            reply = _encode({"id": req.get("id"), "ok": False,
+                             "error": f"internal error: {e}"})
+        if not fut.done():
+            fut.set_result(reply)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Read one request line. Returns b"" at end of stream, or None if the
+    line was longer than the stream limit (it is read and discarded)."""
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            line = b"" if too_long else e.partial
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+            too_long = True
+            continue
+        return None if too_long and line else line
+
+
+async def _handle_client(batcher: Batcher, reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            line = await _read_request(reader)
+            if line is None:
+                writer.write(_encode({
+                    "id": None, "ok": False,
+                    "error": f"request line longer than {MAX_REQUEST_BYTES} bytes"}))
+                await writer.drain()
+                continue
+            if not line:
+                break
+            try:
+                req = json.loads(line)
+                if not isinstance(req, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                reply = _encode({"id": None, "ok": False, "error": f"bad request: {e}"})
+            else:
+                reply = await batcher.submit(req)
+            writer.write(reply)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+def _is_socket(path: str) -> bool:
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _clear_stale_socket(path: str) -> None:
+    """Remove a leftover socket file at path so it can be bound again.
+
+    Raises FileExistsError if path is not a socket, or if a live server is
+    still accepting connections on it.
+    """
+    if not os.path.lexists(path):
+        return
+    if not _is_socket(path):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise FileExistsError(f"another server is already listening on {path}")
+    finally:
+        probe.close()
+
+
+async def serve(socket_path: Optional[str] = None, port: Optional[int] = None,
+                workers: int = DEFAULT_WORKERS,
+                processes: int = DEFAULT_PROCESSES) -> None:
+    """Serve requests until cancelled. Binds a Unix socket if socket_path is
+    given, otherwise localhost:port."""
+    batcher = Batcher(ScoringService(processes), workers=workers)
+    batch_task = asyncio.create_task(batcher.run())
+
+    async def on_connect(reader, writer):
+        await _handle_client(batcher, reader, writer)
+
+    if socket_path:
+        _clear_stale_socket(socket_path)
+        server = await asyncio.start_unix_server(
+            on_connect, path=socket_path, limit=MAX_REQUEST_BYTES)
+        where = socket_path
+    else:
+        server = await asyncio.start_server(
+            on_connect, host="127.0.0.1", port=port, limit=MAX_REQUEST_BYTES)
+        where = f"127.0.0.1:{port}"
+    print(f"motif_server listening on {where}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        batcher.pool.shutdown(wait=False)
+        batcher.service.close()
+        if socket_path and _is_socket(socket_path):
+            os.unlink(socket_path)
+
+
+def query(req: Dict[str, Any], socket_path: Optional[str] = None,
+          port: Optional[int] = None, timeout: float = 30.0) -> Dict[str, Any]:
+    """Send one request to a running server and return its reply.
+
+    Opens a new connection per call; for many queries, keep a socket open and
+    write one JSON line per request instead.
+    """
+    if socket_path:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address: Any = socket_path
+    else:
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = ("127.0.0.1", port)
+    with conn:
+        conn.settimeout(timeout)
+        conn.connect(address)
+        conn.sendall(json.dumps(req).encode() + b"\n")
+        with conn.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("server closed the connection without replying")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", help="Unix socket path to listen on")
+    where.add_argument("--port", type=int, help="localhost TCP port to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"worker threads (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES,
+                        help="worker processes for regions over "
+                             f"{OFFLOAD_BASES} bases; 0 disables "
+                             f"(default: {DEFAULT_PROCESSES})")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket, args.port, args.workers, args.processes))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        sys.exit(f"Error: {e}")
+
+
+if __name__ == '__main__':
+    main()
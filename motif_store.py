@@ -0,0 +1,211 @@
+"""Incremental, checkpointed motif scanning backed by a SQLite results store.
+
+Scans every record of a FASTA reference against one or more motif profiles
+and keeps the scores in a SQLite file. Each (record, motif) pair is stored
+with a content hash of the record sequence and of the motif profile, so a
+rerun only scans pairs that are new or whose inputs changed. Adding motifs to
+a library or contigs to an assembly therefore costs only the new work.
+
+Long scans are written in chunks of CHECKPOINT_WINDOWS windows, each committed
+as soon as it is scored. A job that is killed resumes from the last committed
+chunk instead of starting over.
+
+Results for records or motifs that are no longer in the inputs stay in the
+store until a run with --prune removes them.
+
+Scores are stored as packed float64 arrays (one BLOB per strand per chunk),
+which is far smaller than one row per window.
+
+Usage:
+    python motif_store.py <store.sqlite> <reference.fa> <motif.txt> [<motif.txt> ...] [--output out.tsv] [--prune]
+"""
+
+import argparse
+import csv
+import hashlib
+import sqlite3
+import sys
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from motif_scoring import load_fasta_records, load_motif_profile, scan_sequence
+
+# Constants
+CHECKPOINT_WINDOWS = 100_000  # Windows scored between commits
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    record_id   TEXT NOT NULL,
+    motif_id    TEXT NOT NULL,
+    record_hash TEXT NOT NULL,
+    motif_hash  TEXT NOT NULL,
+    n_windows   INTEGER NOT NULL,
+    done        INTEGER NOT NULL,
+    PRIMARY KEY (record_id, motif_id)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    record_id TEXT NOT NULL,
+    motif_id  TEXT NOT NULL,
+    start     INTEGER NOT NULL,
+    forward   BLOB NOT NULL,
+    reverse   BLOB NOT NULL,
+    PRIMARY KEY (record_id, motif_id, start)
+);
+"""
+
+
+def sequence_hash(seq: str) -> str:
+    return hashlib.sha256(seq.encode()).hexdigest()
+
+
+def profile_hash(profile: List[List[float]]) -> str:
+    """Hash the parsed matrix, so whitespace-only edits don't force a rescan."""
+    text = '\n'.join(' '.join(repr(x) for x in row) for row in profile)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def open_store(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path))
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def scan_pair(conn: sqlite3.Connection, record_id: str, seq: str,
+              motif_id: str, profile: List[List[float]],
+              chunk: int = CHECKPOINT_WINDOWS, r_hash: Optional[str] = None,
+              m_hash: Optional[str] = None) -> int:
+    """Bring one (record, motif) pair up to date in the store.
+
+    Pass r_hash/m_hash when scanning many pairs so each record and profile
+    is hashed once rather than once per pair.
+
+    Returns the number of windows scanned by this call (0 if the stored
+    results were already complete and current).
+    """
+    if r_hash is None:
+        r_hash = sequence_hash(seq)
+    if m_hash is None:
+        m_hash = profile_hash(profile)
+    n_windows = max(len(seq) - len(profile[0]) + 1, 0)
+
+    row = conn.execute(
+        "SELECT record_hash, motif_hash, done FROM pairs "
+        "WHERE record_id = ? AND motif_id = ?", (record_id, motif_id)).fetchone()
+    if row and row[0] == r_hash and row[1] == m_hash:
+        done = row[2]
+    else:
+        # New pair, or its inputs changed: drop stale results and start over
+        done = 0
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE record_id = ? AND motif_id = ?",
+                         (record_id, motif_id))
+            conn.execute("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, 0)",
+                         (record_id, motif_id, r_hash, m_hash, n_windows))
+
+    scanned = 0
+    for start in range(done, n_windows, chunk):
+        end = min(start + chunk, n_windows)
+        forward, reverse = array('d'), array('d')
+        for _, sf, sr, _ in scan_sequence(seq, profile, start, end):
+            forward.append(sf)
+            reverse.append(sr)
+        # One transaction per chunk: the chunk and the progress marker land together
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                         (record_id, motif_id, start,
+                          forward.tobytes(), reverse.tobytes()))
+            conn.execute("UPDATE pairs SET done = ? "
+                         "WHERE record_id = ? AND motif_id = ?",
+                         (end, record_id, motif_id))
+        scanned += end - start
+    return scanned
+
+
+def prune_store(conn: sqlite3.Connection,
+                keep: Iterable[Tuple[str, str]]) -> int:
+    """Delete every (record, motif) pair not in keep, with its results.
+
+    Returns the number of pairs removed.
+    """
+    keep_set: Set[Tuple[str, str]] = set(keep)
+    stale = [key for key in conn.execute("SELECT record_id, motif_id FROM pairs")
+             if key not in keep_set]
+    with conn:
+        conn.executemany("DELETE FROM chunks WHERE record_id = ? AND motif_id = ?", stale)
+        conn.executemany("DELETE FROM pairs WHERE record_id = ? AND motif_id = ?", stale)
+    return len(stale)
+
+
+def iter_results(conn: sqlite3.Connection, record_id: str,
+                 motif_id: str) -> Iterator[Tuple[int, float, float, float]]:
+    """Yield (position, score_forward, score_reverse, score_best) from the store."""
+    rows = conn.execute(
+        "SELECT start, forward, reverse FROM chunks "
+        "WHERE record_id = ? AND motif_id = ? ORDER BY start",
+        (record_id, motif_id))
+    for start, fwd_blob, rev_blob in rows:
+        forward, reverse = array('d'), array('d')
+        forward.frombytes(fwd_blob)
+        reverse.frombytes(rev_blob)
+        for i, (sf, sr) in enumerate(zip(forward, reverse)):
+            yield start + i, sf, sr, max(sf, sr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scan a FASTA reference with motif profiles, reusing stored results.")
+    parser.add_argument("store", type=Path, help="SQLite results store (created if missing)")
+    parser.add_argument("reference", type=Path, help="FASTA reference, one or more records")
+    parser.add_argument("motifs", type=Path, nargs='+', help="motif profile files")
+    parser.add_argument("--output", type=Path, help="write all results as TSV")
+    parser.add_argument("--prune", action="store_true",
+                        help="delete stored results for records or motifs not in this run")
+    args = parser.parse_args()
+
+    records = load_fasta_records(args.reference)
+    if len({record_id for record_id, _ in records}) != len(records):
+        sys.exit("Error: Record ids must be unique (the first word of each FASTA header).")
+    profiles = [(p.stem, load_motif_profile(p)) for p in args.motifs]
+    if len({name for name, _ in profiles}) != len(profiles):
+        sys.exit("Error: Motif file names must be unique (the stem is the motif id).")
+
+    conn = open_store(args.store)
+    try:
+        if args.prune:
+            removed = prune_store(conn, ((record_id, motif_id)
+                                         for record_id, _ in records
+                                         for motif_id, _ in profiles))
+            print(f"Pruned {removed} stale pairs", file=sys.stderr)
+
+        total = 0
+        m_hashes = [profile_hash(profile) for _, profile in profiles]
+        for record_id, seq in records:
+            r_hash = sequence_hash(seq)
+            for (motif_id, profile), m_hash in zip(profiles, m_hashes):
+                scanned = scan_pair(conn, record_id, seq, motif_id, profile,
+                                    r_hash=r_hash, m_hash=m_hash)
+                if scanned:
+                    print(f"Scanned {record_id} x {motif_id}: {scanned} windows",
+                          file=sys.stderr)
+                total += scanned
+        print(f"{len(records) * len(profiles)} pairs up to date, "
+              f"{total} windows scanned this run", file=sys.stderr)
+
+        if args.output:
+            with open(args.output, 'w', newline='') as out_fh:
+                writer = csv.writer(out_fh, delimiter='\t')
+                writer.writerow(["record", "motif", "position",
+                                 "score_forward", "score_reverse", "score_best"])
+                for record_id, _ in records:
+                    for motif_id, _ in profiles:
+                        for pos, sf, sr, sb in iter_results(conn, record_id, motif_id):
+                            writer.writerow([record_id, motif_id, pos,
+                                             f"{sf:.4f}", f"{sr:.4f}", f"{sb:.4f}"])
+            print(f"Results written to {args.output}", file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()